@@ -2,26 +2,67 @@
 """
 Simple Coqui TTS Server for Voice Cloning
 This server provides voice cloning capabilities using Coqui TTS
+
+For production, serve it with gunicorn instead of the Flask dev server:
+    gunicorn -c gunicorn.conf.py coqui_server:app
 """
 
 import os
 import io
+import sys
+import math
+import uuid
+import atexit
 import json
+import shutil
+import hashlib
+import queue
+import struct
 import tempfile
-from flask import Flask, request, jsonify, send_file
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import torch
 from TTS.api import TTS
 import numpy as np
 import soundfile as sf
+from scipy import signal
 import logging
 
+# Optional high-quality polyphase resampler (scipy is the fallback)
+try:
+    import soxr
+except ImportError:
+    soxr = None
+
+# Optional decoder for uploads soundfile can't read (webm, mp3, m4a)
+try:
+    from pydub import AudioSegment
+except ImportError:
+    AudioSegment = None
+else:
+    # Set ffmpeg path explicitly when the Homebrew build is installed
+    if os.path.exists("/opt/homebrew/bin/ffmpeg"):
+        AudioSegment.converter = "/opt/homebrew/bin/ffmpeg"
+        AudioSegment.ffmpeg = "/opt/homebrew/bin/ffmpeg"
+    if os.path.exists("/opt/homebrew/bin/ffprobe"):
+        AudioSegment.ffprobe = "/opt/homebrew/bin/ffprobe"
+
 # Fix PyTorch weights loading issue
 import torch.serialization
+from torch.nn.utils import parametrize
 from TTS.tts.configs.xtts_config import XttsConfig
 from TTS.tts.models.xtts import XttsAudioConfig
 torch.serialization.add_safe_globals([XttsConfig, XttsAudioConfig])
 
+# The server only runs inference. Grad mode is thread-local, so this covers only the
+# importing thread (model loading); the synthesis worker relies on inference_context()
+torch.set_grad_enabled(False)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,6 +73,563 @@ CORS(app)
 # Initialize TTS model
 tts = None
 
+# Whether the model weights were converted to FP16 (GPU only)
+_USE_FP16 = False
+
+# One scratch directory per server process for per-request speaker files
+SCRATCH_DIR = tempfile.mkdtemp(prefix="coqui_")
+atexit.register(shutil.rmtree, SCRATCH_DIR, ignore_errors=True)
+
+def scratch_path(suffix='.wav'):
+    """Return a fresh, unique file path inside the scratch directory"""
+    return os.path.join(SCRATCH_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+# Synthetic speaker reference used when no voice sample is available. It lives in
+# temp_voices next to uploaded voices, so voice lookups must skip it by name.
+DEFAULT_SPEAKER_FILENAME = "default_speaker.wav"
+_DEFAULT_SPEAKER_PATH = None
+
+# Conditioning latents for the default voice, computed once at startup
+DEFAULT_GPT_LATENT = None
+DEFAULT_SPEAKER_EMB = None
+
+def _ensure_default_speaker():
+    """Create the synthetic default speaker WAV once and remember its path"""
+    global _DEFAULT_SPEAKER_PATH
+    temp_voices_dir = "temp_voices"
+    path = os.path.join(temp_voices_dir, DEFAULT_SPEAKER_FILENAME)
+
+    if not os.path.exists(path):
+        os.makedirs(temp_voices_dir, exist_ok=True)
+
+        # Generate a simple voice-like sound (formant synthesis approximation)
+        sample_rate = 22050
+        duration = 2.0  # 2 seconds
+        t = np.linspace(0, duration, int(sample_rate * duration), False, dtype=np.float32)
+
+        # Create a more voice-like sound with multiple harmonics, summed in one matmul
+        fundamental = 150  # Hz, typical male voice
+        harmonics = np.arange(1, 5, dtype=np.float32)
+        amplitudes = np.array([0.5, 0.3, 0.2, 0.1], dtype=np.float32)
+        phases = np.float32(2 * np.pi * fundamental) * np.outer(t, harmonics)
+        voice_signal = np.sin(phases, out=phases) @ amplitudes
+
+        # Add some envelope to make it more natural, then normalize in place
+        voice_signal *= np.exp(np.float32(-0.5) * t)  # Decay envelope
+        voice_signal *= np.float32(0.7) / np.abs(voice_signal).max()
+
+        sf.write(path, voice_signal, sample_rate)
+        logger.info(f"Created default speaker audio: {path}")
+
+    _DEFAULT_SPEAKER_PATH = path
+    return path
+
+@contextmanager
+def inference_context():
+    """Inference mode, plus FP16 autocast so FP32 inputs match half-precision weights"""
+    with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=_USE_FP16):
+        yield
+
+def _run_in_fp32(module):
+    """Make module compute in FP32: FP32 weights, upcast inputs and autocast disabled"""
+    module.float()
+    forward = module.forward
+
+    def upcast(value):
+        return value.float() if torch.is_tensor(value) and value.is_floating_point() else value
+
+    def fp32_forward(*args, **kwargs):
+        with torch.autocast("cuda", enabled=False), torch.autocast("cpu", enabled=False):
+            return forward(*map(upcast, args), **{k: upcast(v) for k, v in kwargs.items()})
+
+    module.forward = fp32_forward
+
+def _enable_fp16(model):
+    """Convert the model to FP16 for tensor-core inference, keeping sensitive parts in FP32"""
+    global _USE_FP16
+    model.half()
+
+    # Autocast already runs layer_norm in FP32; keep the affine weights unrounded too
+    for module in model.modules():
+        if isinstance(module, torch.nn.LayerNorm):
+            module.float()
+
+    # The speaker encoder's spectrogram frontend and convs are unstable in FP16,
+    # so exclude it from autocast entirely
+    speaker_encoder = getattr(model.hifigan_decoder, "speaker_encoder", None)
+    if speaker_encoder is not None:
+        _run_in_fp32(speaker_encoder)
+
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+    _USE_FP16 = True
+
+class CudaGraphedModule(torch.nn.Module):
+    """Replays a CUDA graph of the wrapped vocoder per input shape bucket
+
+    The time dimension of the latents is padded up to a multiple of bucket_frames
+    so a handful of captured graphs cover all chunk lengths; the output is trimmed
+    back to the unpadded length. Padding repeats the last real frame, so the
+    decoder's linear interpolation does not blend the tail with zeros. Shapes
+    whose capture fails run the wrapped module eagerly.
+    """
+
+    def __init__(self, module, bucket_frames=256, warmup_iters=3):
+        super().__init__()
+        self.module = module
+        self.bucket_frames = bucket_frames
+        self.warmup_iters = warmup_iters
+        self._graphs = {}
+
+    def __getattr__(self, name):
+        # XTTS reaches into the decoder (e.g. speaker_encoder), so expose the wrapped module's attributes
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self._modules["module"], name)
+
+    def _padded_shape(self, latents):
+        bucket = -(-latents.shape[1] // self.bucket_frames) * self.bucket_frames
+        return (latents.shape[0], bucket) + tuple(latents.shape[2:])
+
+    @staticmethod
+    def _pad_into(buffer, latents):
+        """Copy latents into the bucket-sized buffer, repeating the last frame into the tail"""
+        frames = latents.shape[1]
+        buffer[:, :frames].copy_(latents)
+        if frames < buffer.shape[1]:
+            buffer[:, frames:].copy_(latents[:, -1:].expand_as(buffer[:, frames:]))
+
+    def _interpolated_frames(self, frames):
+        """Generator input length for frames latents, computed like HifiDecoder's interpolate calls"""
+        decoder = self.module
+        length = math.floor(frames * (decoder.ar_mel_length_compression / decoder.output_hop_length))
+        if decoder.output_sample_rate != decoder.input_sample_rate:
+            length = math.floor(length * (decoder.output_sample_rate / decoder.input_sample_rate))
+        return length
+
+    def _trim(self, padded_out, bucket, frames):
+        """Cut a padded bucket's waveform back to the length the unpadded latents decode to"""
+        # Resampling to 24 kHz gives a fractional number of samples per latent frame,
+        # but the generator itself upsamples its input by a whole factor
+        upsample = padded_out.shape[-1] // self._interpolated_frames(bucket)
+        return padded_out[..., :self._interpolated_frames(frames) * upsample]
+
+    def _capture(self, latents, g):
+        static_in = torch.zeros_like(latents)
+        static_g = None if g is None else torch.zeros_like(g)
+
+        # Warm up on a side stream so lazy allocations stay out of the graph
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(self.warmup_iters):
+                self.module(static_in, g=static_g)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_out = self.module(static_in, g=static_g)
+        return graph, static_in, static_g, static_out
+
+    def forward(self, latents, g=None):
+        if not latents.is_cuda:
+            return self.module(latents, g=g)
+
+        padded_shape = self._padded_shape(latents)
+        key = (padded_shape, None if g is None else tuple(g.shape), latents.dtype)
+
+        if key not in self._graphs:
+            logger.info(f"Capturing vocoder CUDA graph for shape {padded_shape}")
+            try:
+                self._graphs[key] = self._capture(latents.new_zeros(padded_shape), g)
+            except Exception as e:
+                # Remember the failure so later calls with this shape don't retry the capture
+                logger.warning(f"Vocoder CUDA graph capture failed, running eagerly for shape {padded_shape}: {e}")
+                self._graphs[key] = None
+        if self._graphs[key] is None:
+            return self.module(latents, g=g)
+        graph, static_in, static_g, static_out = self._graphs[key]
+
+        self._pad_into(static_in, latents)
+        if static_g is not None:
+            static_g.copy_(g)
+        graph.replay()
+        return self._trim(static_out, padded_shape[1], latents.shape[1]).clone()
+
+def conditioning_kwargs(config):
+    """Speaker-encoding settings Xtts.synthesize() passes on to get_conditioning_latents()"""
+    return {
+        "gpt_cond_len": config.gpt_cond_len,
+        "gpt_cond_chunk_len": config.gpt_cond_chunk_len,
+        "max_ref_length": config.max_ref_len,
+        "sound_norm_refs": config.sound_norm_refs,
+    }
+
+def sampling_kwargs(config):
+    """Sampling settings Xtts.synthesize() passes on to inference()"""
+    return {
+        "temperature": config.temperature,
+        "length_penalty": config.length_penalty,
+        "repetition_penalty": config.repetition_penalty,
+        "top_k": config.top_k,
+        "top_p": config.top_p,
+    }
+
+# Silence Synthesizer.tts() appends after every synthesized sentence
+SENTENCE_PAUSE_SAMPLES = 10000
+
+class SpeakerLatentCache:
+    """Bounded LRU of XTTS conditioning latents keyed by the speaker file's SHA-1"""
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def file_digest(path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def get(self, speaker_wav):
+        """Return (gpt_cond_latent, speaker_embedding), encoding the file only on a miss"""
+        key = self.file_digest(speaker_wav)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        model = tts.synthesizer.tts_model
+        latents = model.get_conditioning_latents(audio_path=speaker_wav, **conditioning_kwargs(model.config))
+
+        with self._lock:
+            self._entries[key] = latents
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return latents
+
+speaker_latents = SpeakerLatentCache()
+
+# Upper bound on how long a handler waits for its synthesis to finish
+SYNTHESIS_TIMEOUT = 300
+
+class TTSWorker:
+    """Runs all synthesis on one background thread, in arrival order
+
+    Funnelling GPU work through a single thread keeps concurrent requests from
+    contending for the model. XTTS inference takes one text per call, so
+    requests are not batched; repeated voices share conditioning latents
+    through the speaker latent cache instead.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, text, speaker_wav, language):
+        """Queue a synthesis request and return a Future resolving to the waveform
+
+        A speaker_wav of None synthesizes with the precomputed default voice.
+        """
+        if not isinstance(text, str) or not isinstance(language, str):
+            raise ValueError("text and language must be strings")
+        if speaker_wav is not None and not isinstance(speaker_wav, str):
+            raise ValueError("speaker_wav must be a file path")
+
+        future = Future()
+        self._queue.put((text, speaker_wav, language, future))
+        self._ensure_worker()
+        return future
+
+    def _ensure_worker(self):
+        # Started lazily so the thread lives in the process that serves requests
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="tts-worker", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            text, speaker_wav, language, future = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            # Every failure resolves the future, so no handler is left waiting
+            try:
+                # Grad and autocast modes are thread-local, so enter them on the worker itself
+                with inference_context():
+                    wav = self._synthesize(text, speaker_wav, language)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(wav)
+
+    def _synthesize(self, text, speaker_wav, language):
+        if speaker_wav is None:
+            gpt_cond_latent, speaker_embedding = DEFAULT_GPT_LATENT, DEFAULT_SPEAKER_EMB
+        else:
+            gpt_cond_latent, speaker_embedding = speaker_latents.get(speaker_wav)
+
+        # Split and join sentences the way tts.tts() does, with the same config settings
+        model = tts.synthesizer.tts_model
+        settings = sampling_kwargs(model.config)
+        parts = []
+        for sentence in tts.synthesizer.split_into_sentences(text):
+            out = model.inference(sentence, language, gpt_cond_latent, speaker_embedding, **settings)
+            wav = np.asarray(out["wav"]).reshape(-1)
+            parts.append(wav)
+            parts.append(np.zeros(SENTENCE_PAUSE_SAMPLES, dtype=wav.dtype))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+tts_worker = TTSWorker()
+
+def discard_scratch_file(path, future=None):
+    """Delete a per-request scratch file once no queued or running synthesis can read it"""
+    if path is None:
+        return
+
+    def unlink(_=None):
+        if os.path.exists(path):
+            os.unlink(path)
+
+    # A timed-out job the worker already started still reads the file, so wait for it
+    if future is not None and not future.done():
+        future.add_done_callback(unlink)
+    else:
+        unlink()
+
+def synthesis_timeout_response(future):
+    """Give up on a synthesis that outlived SYNTHESIS_TIMEOUT and tell the client to retry"""
+    # A job the worker has not started yet is dropped, so it never runs for a client that is gone
+    future.cancel()
+    logger.error(f"Speech synthesis timed out after {SYNTHESIS_TIMEOUT}s")
+    return jsonify({"error": f"Speech synthesis timed out after {SYNTHESIS_TIMEOUT}s, the server is busy. Please retry."}), 503
+
+# Copy uploads in 1 MB chunks instead of Werkzeug's 16 KB default
+UPLOAD_COPY_BUFFER = 1 << 20
+
+def save_upload(file_storage, dst):
+    """Copy an uploaded file into the open file dst with as few syscalls as possible"""
+    src = file_storage.stream
+
+    # Werkzeug spools uploads in memory and rolls large ones over to a real file.
+    # Once rolled, the spool's fileno() and tell() are the underlying file's; before
+    # that, fileno() would force a rollover, so in-memory spools are copied instead.
+    disk_backed = not isinstance(src, tempfile.SpooledTemporaryFile) or src._rolled
+
+    # On Linux, let the kernel copy disk-backed uploads directly between descriptors
+    if disk_backed and sys.platform.startswith('linux'):
+        try:
+            in_fd = src.fileno()
+            offset = src.tell()
+            size = os.fstat(in_fd).st_size
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            in_fd = None
+        if in_fd is not None:
+            try:
+                while offset < size:
+                    sent = os.sendfile(dst.fileno(), in_fd, offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+            except OSError as e:
+                logger.warning(f"sendfile failed, copying the rest of the upload: {e}")
+            if offset >= size:
+                return
+            # sendfile never moves src's own position, so resume the copy where it stopped
+            src.seek(offset)
+
+    shutil.copyfileobj(src, dst, length=UPLOAD_COPY_BUFFER)
+
+def build_wav_header(data_size, sample_rate, channels=1, bits_per_sample=16):
+    """Build a canonical 44-byte PCM WAV header for data_size bytes of samples"""
+    block_align = channels * bits_per_sample // 8
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits_per_sample,
+        b'data', data_size
+    )
+
+def wav_iter(samples, sample_rate):
+    """Yield a WAV file for int16 samples: header first, then the raw PCM"""
+    yield build_wav_header(samples.nbytes, sample_rate)
+    yield samples.tobytes()
+
+def wav_response(wav, sample_rate, download_name):
+    """Stream float audio back to the client as a PCM_16 WAV"""
+    # Ensure wav is a numpy array (no copy if it already is one)
+    wav = np.asarray(wav)
+
+    # Normalize to prevent clipping, scaling straight into a preallocated int16 buffer
+    peak = float(np.abs(wav).max()) if wav.size else 0.0
+    scale = 32767.0 / max(peak, 1.0)
+    pcm = np.empty(wav.shape, dtype='<i2')
+    np.multiply(wav, scale, out=pcm, dtype=np.float32, casting='unsafe')
+    return Response(
+        wav_iter(pcm, sample_rate),
+        mimetype='audio/wav',
+        headers={
+            # Full length up front avoids 206 Partial Content handling in clients
+            'Content-Length': str(44 + pcm.nbytes),
+            'Content-Disposition': f'inline; filename={download_name}'
+        }
+    )
+
+def _first_file(directory, suffixes, exclude=()):
+    """Return the path of the first regular file in directory ending with suffixes"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffixes) and entry.name not in exclude and entry.is_file():
+                return entry.path
+    return None
+
+def _resolve_default_speaker():
+    """Pick the default speaker reference, preferring an existing WAV in temp_voices"""
+    temp_voices_dir = "temp_voices"
+
+    if os.path.isdir(temp_voices_dir):
+        # Look for WAV files only (Coqui TTS works best with WAV), never the synthetic one
+        default_speaker_path = _first_file(temp_voices_dir, '.wav', exclude=(DEFAULT_SPEAKER_FILENAME,))
+        if default_speaker_path:
+            logger.info(f"Using existing WAV voice file as default: {default_speaker_path}")
+            return default_speaker_path
+
+        # If no WAV files, look for other formats and report them
+        source_file = _first_file(temp_voices_dir, ('.webm', '.mp3', '.m4a'))
+        if source_file:
+            logger.info(f"Found non-WAV file, will create default speaker instead: {source_file}")
+
+    return _ensure_default_speaker()
+
+def _load_default_speaker_latents():
+    """Encode the default speaker once and keep its latents resident on the model device"""
+    global DEFAULT_GPT_LATENT, DEFAULT_SPEAKER_EMB
+    default_speaker_path = _resolve_default_speaker()
+
+    with inference_context():
+        gpt_cond_latent, speaker_embedding = speaker_latents.get(default_speaker_path)
+
+    param = next(tts.synthesizer.tts_model.parameters())
+    DEFAULT_GPT_LATENT = gpt_cond_latent.to(device=param.device, dtype=param.dtype)
+    DEFAULT_SPEAKER_EMB = speaker_embedding.to(device=param.device, dtype=param.dtype)
+    logger.info(f"Precomputed default speaker latents from: {default_speaker_path}")
+
+# Canned start-up inputs of different lengths. torch.compile has no shape buckets:
+# the first run compiles shape-generic graphs and the second checks that a new
+# length reuses them instead of recompiling on the request path.
+WARMUP_TEXTS = [
+    "Hello, this is a warm up.",
+    "This is a longer warm up sentence, so that the model has already seen a realistic "
+    "prompt length before the first request arrives.",
+]
+
+def _warm_up_tts(texts):
+    """Run canned syntheses so one-off setup work happens before the first request"""
+    logger.info(f"Warming up TTS model with {len(texts)} canned synthesis run(s)...")
+    start = time.perf_counter()
+    for text in texts:
+        run_start = time.perf_counter()
+        # Go through the worker: compiled CUDA graph state is per thread, so warm
+        # up on the same thread that will serve requests
+        tts_worker.submit(text, None, "en").result()
+        logger.info(f"Warm-up run ({len(text)} chars) took {time.perf_counter() - run_start:.2f}s")
+    logger.info(f"TTS warm-up complete in {time.perf_counter() - start:.2f}s (startup only, not request latency)")
+
+def _compile_tts_model():
+    """Compile the XTTS GPT decoder and HiFi-GAN vocoder, falling back to eager mode"""
+    model = tts.synthesizer.tts_model
+    eager_gpt, eager_decoder = model.gpt, model.hifigan_decoder
+    gpt_inference = eager_gpt.gpt_inference
+    try:
+        # inference() calls gpt.generate(), which a compiled wrapper forwards to the
+        # eager module, so compile the per-token forward that generate() calls
+        # instead. Prompt and KV-cache lengths change every step, so compile for
+        # dynamic shapes; reduce-overhead would record a CUDA graph per step length.
+        gpt_inference.forward = torch.compile(gpt_inference.forward, dynamic=True)
+
+        # The return_latent pass and the vocoder run once per sentence, so CUDA
+        # graphs pay off there; each new latent length records another graph
+        model.gpt = torch.compile(eager_gpt, mode="reduce-overhead", dynamic=True)
+        model.hifigan_decoder = torch.compile(eager_decoder, mode="reduce-overhead", dynamic=True)
+
+        # Compilation is lazy, so trigger it now rather than on the first request
+        _warm_up_tts(WARMUP_TEXTS)
+        logger.info("Compiled XTTS submodules with torch.compile")
+        return True
+    except Exception as e:
+        logger.warning(f"torch.compile failed, using eager mode: {e}")
+        gpt_inference.__dict__.pop("forward", None)
+        model.gpt, model.hifigan_decoder = eager_gpt, eager_decoder
+        return False
+
+class TracedGenerator(torch.nn.Module):
+    """Calls a traced HiFi-GAN generator, keeping the eager one for calls it wasn't traced for"""
+
+    def __init__(self, traced, eager, conditioned):
+        super().__init__()
+        self.traced = traced
+        self.eager = eager
+        self.conditioned = conditioned
+
+    def forward(self, x, g=None):
+        if x.is_cuda or self.conditioned != (g is not None):
+            return self.eager(x, g=g)
+
+        # HifiDecoder squeezes the batch dim when resampling, and traced convs
+        # only take batched input. Eager broadcasts back to batched once g is
+        # added, so only the unconditioned output needs squeezing.
+        unbatched = x.dim() == 2
+        if unbatched:
+            x = x.unsqueeze(0)
+        if self.conditioned:
+            return self.traced(x, g)
+        o = self.traced(x)
+        return o.squeeze(0) if unbatched else o
+
+def _trace_vocoder():
+    """TorchScript-trace and freeze the HiFi-GAN generator for CPU inference"""
+    decoder = tts.synthesizer.tts_model.hifigan_decoder
+    try:
+        # Trace the inner generator; freezing the outer decoder would drop its
+        # speaker encoder, which conditioning latent extraction still needs
+        voc = decoder.waveform_decoder.eval()
+
+        # Fold weight norm into plain weights so the trace holds no parametrization hooks.
+        # Done per module: HifiganGenerator.remove_weight_norm() raises partway through
+        # when some layers (e.g. conv_pre) were never weight-normed.
+        for module in voc.modules():
+            if parametrize.is_parametrized(module, "weight"):
+                parametrize.remove_parametrizations(module, "weight")
+            elif hasattr(module, "weight_g"):
+                torch.nn.utils.remove_weight_norm(module)
+
+        # The generator is purely convolutional, so one traced length generalizes;
+        # check that against eager output at a second length before using it
+        in_channels = voc.conv_pre.in_channels
+        conditioned = hasattr(voc, "cond_layer")
+        g = torch.randn(1, voc.cond_layer.in_channels, 1) if conditioned else None
+
+        def example(frames):
+            x = torch.randn(1, in_channels, frames)
+            return (x, g) if conditioned else (x,)
+
+        check = example(97)
+        frozen = torch.jit.freeze(torch.jit.trace(voc, example(64), check_inputs=[check]))
+        torch.testing.assert_close(frozen(*check), voc(*check), rtol=1e-3, atol=1e-4)
+
+        decoder.waveform_decoder = TracedGenerator(frozen, voc, conditioned)
+        logger.info("Traced and froze HiFi-GAN vocoder with TorchScript")
+        return True
+    except Exception as e:
+        logger.warning(f"TorchScript vocoder tracing failed, using eager mode: {e}")
+        return False
+
 def initialize_tts():
     """Initialize the TTS model"""
     global tts
@@ -41,7 +639,6 @@ def initialize_tts():
         logger.info(f"Loading TTS model: {model_name}")
 
         # Set weights_only=False to bypass PyTorch security restrictions
-        import torch
         original_load = torch.load
         torch.load = lambda *args, **kwargs: original_load(*args, **kwargs, weights_only=False)
 
@@ -50,9 +647,38 @@ def initialize_tts():
         # Restore original torch.load
         torch.load = original_load
 
-        logger.info("TTS model loaded successfully")
+        # Move the model to the best device and put it in inference mode, using FP16 on GPU
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        tts.to(device)
+        tts.synthesizer.tts_model.eval()
+        if device == "cuda":
+            _enable_fp16(tts.synthesizer.tts_model)
+
+        logger.info(f"TTS model loaded successfully on {device}{' (fp16)' if _USE_FP16 else ''}")
         logger.info(f"Model type: {type(tts.synthesizer.tts_model).__name__}")
 
+        _load_default_speaker_latents()
+
+        compiled = traced = False
+        if device == "cuda":
+            # reduce-overhead compilation already uses CUDA graphs; otherwise graph the vocoder directly
+            compiled = _compile_tts_model()
+            if not compiled:
+                model = tts.synthesizer.tts_model
+                model.hifigan_decoder = CudaGraphedModule(model.hifigan_decoder)
+                logger.info("Wrapped HiFi-GAN vocoder with CUDA graph replay")
+        else:
+            # On CPU, TorchScript cuts dispatcher overhead and works without Triton
+            traced = _trace_vocoder()
+
+        # Compilation already ran the warm-up; otherwise canned runs still prime the pipeline.
+        # The TorchScript profiling executor needs a couple of runs before it fuses.
+        if not compiled:
+            try:
+                _warm_up_tts(WARMUP_TEXTS if traced else WARMUP_TEXTS[:1])
+            except Exception as e:
+                logger.warning(f"TTS warm-up failed: {e}")
+
         return True
     except Exception as e:
         logger.error(f"Failed to load TTS model: {e}")
@@ -61,6 +687,8 @@ def initialize_tts():
 @app.route('/api/tts', methods=['GET', 'POST'])
 def text_to_speech():
     """Generate speech from text"""
+    # Only files this handler wrote are deleted afterwards, never client-named paths
+    upload_path = future = None
     try:
         if request.method == 'GET':
             # Health check
@@ -76,6 +704,10 @@ def text_to_speech():
             text = data.get('text', '')
             speaker_wav = data.get('speaker_wav')
             language = data.get('language', 'en')
+
+            # JSON bodies can carry any type; synthesis only accepts strings
+            if not all(isinstance(v, str) for v in (text, language)) or not isinstance(speaker_wav, (str, type(None))):
+                return jsonify({"error": "text, language and speaker_wav must be strings"}), 400
         else:
             # Handle form data
             text = request.form.get('text', '')
@@ -87,9 +719,9 @@ def text_to_speech():
                 speaker_file = request.files['speaker_wav']
                 if speaker_file.filename:
                     # Save uploaded file temporarily
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-                        speaker_file.save(tmp_file.name)
-                        speaker_wav = tmp_file.name
+                    upload_path = speaker_wav = scratch_path()
+                    with open(speaker_wav, 'wb') as tmp_file:
+                        save_upload(speaker_file, tmp_file)
 
         if not text:
             return jsonify({"error": "Text is required"}), 400
@@ -100,116 +732,40 @@ def text_to_speech():
         if speaker_wav:
             # Voice cloning with speaker reference
             logger.info(f"Using speaker reference for voice cloning: {speaker_wav}")
+            future = tts_worker.submit(text, speaker_wav, language)
             try:
-                wav = tts.tts(text=text, speaker_wav=speaker_wav, language=language)
+                wav = future.result(timeout=SYNTHESIS_TIMEOUT)
+            except FutureTimeoutError:
+                return synthesis_timeout_response(future)
             except Exception as clone_error:
                 logger.error(f"Voice cloning failed: {clone_error}")
                 raise Exception(f"Voice cloning failed: {str(clone_error)}")
         else:
-            # For XTTS v2, we need a speaker reference. Let's create a simple default one
+            # XTTS v2 needs a speaker reference; use the default voice latents prepared at startup
             logger.info("No speaker reference provided, using default voice")
 
-            # Use a pre-existing audio file from the temp_voices directory if available
-            temp_voices_dir = "temp_voices"
-            default_speaker_path = None
-
-            if os.path.exists(temp_voices_dir):
-                # Look for WAV files only (Coqui TTS works best with WAV)
-                voice_files = [f for f in os.listdir(temp_voices_dir) if f.endswith('.wav')]
-                if voice_files:
-                    default_speaker_path = os.path.join(temp_voices_dir, voice_files[0])
-                    logger.info(f"Using existing WAV voice file as default: {default_speaker_path}")
-                else:
-                    # If no WAV files, look for other formats and convert them
-                    other_files = [f for f in os.listdir(temp_voices_dir) if f.endswith(('.webm', '.mp3', '.m4a'))]
-                    if other_files:
-                        source_file = os.path.join(temp_voices_dir, other_files[0])
-                        logger.info(f"Found non-WAV file, will create default speaker instead: {source_file}")
-
-            if not default_speaker_path:
-                # Create a minimal default speaker audio
-                import numpy as np
-
-                # Generate a simple voice-like sound (formant synthesis approximation)
-                sample_rate = 22050
-                duration = 2.0  # 2 seconds
-                t = np.linspace(0, duration, int(sample_rate * duration), False)
-
-                # Create a more voice-like sound with multiple harmonics
-                fundamental = 150  # Hz, typical male voice
-                voice_signal = (
-                    0.5 * np.sin(2 * np.pi * fundamental * t) +
-                    0.3 * np.sin(2 * np.pi * fundamental * 2 * t) +
-                    0.2 * np.sin(2 * np.pi * fundamental * 3 * t) +
-                    0.1 * np.sin(2 * np.pi * fundamental * 4 * t)
-                )
-
-                # Add some envelope to make it more natural
-                envelope = np.exp(-t * 0.5)  # Decay envelope
-                voice_signal *= envelope
-
-                # Normalize
-                voice_signal = voice_signal / np.max(np.abs(voice_signal)) * 0.7
-
-                # Save as temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-                    sf.write(tmp_file.name, voice_signal, sample_rate)
-                    default_speaker_path = tmp_file.name
-
-                logger.info(f"Created default speaker audio: {default_speaker_path}")
-
+            future = tts_worker.submit(text, None, language)
             try:
-                wav = tts.tts(text=text, speaker_wav=default_speaker_path, language=language)
-
-                # Clean up temporary file if we created one
-                if default_speaker_path and default_speaker_path.startswith('/tmp'):
-                    os.unlink(default_speaker_path)
-
+                wav = future.result(timeout=SYNTHESIS_TIMEOUT)
+            except FutureTimeoutError:
+                return synthesis_timeout_response(future)
             except Exception as default_error:
-                # Clean up temporary file if we created one
-                if default_speaker_path and default_speaker_path.startswith('/tmp') and os.path.exists(default_speaker_path):
-                    os.unlink(default_speaker_path)
                 logger.error(f"Default TTS generation failed: {default_error}")
                 raise Exception(f"TTS generation failed: {str(default_error)}. For best results, please upload a voice sample for cloning.")
-        
-        # Convert to audio file with proper format
-        audio_buffer = io.BytesIO()
-
-        # Ensure wav is a numpy array and has the right format
-        if isinstance(wav, list):
-            wav = np.array(wav)
-
-        # Normalize audio to prevent clipping
-        if wav.max() > 1.0 or wav.min() < -1.0:
-            wav = wav / np.max(np.abs(wav))
-
-        # Write as WAV with proper sample rate
-        sf.write(audio_buffer, wav, 22050, format='WAV', subtype='PCM_16')
-        audio_buffer.seek(0)
-
-        # Get the size for proper headers
-        audio_size = audio_buffer.getbuffer().nbytes
-
-        # Clean up temporary file if created
-        if speaker_wav and os.path.exists(speaker_wav):
-            os.unlink(speaker_wav)
-
-        # Return with proper headers to avoid 206 Partial Content
-        return send_file(
-            audio_buffer,
-            mimetype='audio/wav',
-            as_attachment=False,
-            download_name='speech.wav',
-            conditional=False  # Disable conditional requests that cause 206
-        )
+
+        # Stream as WAV with proper sample rate
+        return wav_response(wav, 22050, 'speech.wav')
         
     except Exception as e:
         logger.error(f"TTS generation error: {e}")
         return jsonify({"error": str(e)}), 500
+    finally:
+        discard_scratch_file(upload_path, future)
 
 @app.route('/api/tts/speaker-similarity', methods=['POST'])
 def speaker_similarity_tts():
     """Generate speech with speaker similarity (voice cloning)"""
+    speaker_wav_path = future = None
     try:
         text = request.form.get('text', '')
         language = request.form.get('language', 'en')
@@ -222,145 +778,111 @@ def speaker_similarity_tts():
             
         speaker_file = request.files['speaker_wav']
 
-        # Save uploaded file temporarily and ensure it's a proper WAV file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-            speaker_file.save(tmp_file.name)
-            speaker_wav_path = tmp_file.name
+        # Read the upload into memory; everything up to the final write happens there
+        audio_bytes = io.BytesIO(speaker_file.stream.read())
 
-        # Verify and convert the audio file to a format Coqui TTS can read
+        # Verify and convert the audio to a format Coqui TTS can read
         try:
-            import soundfile as sf
-            import numpy as np
-
-            # First, try to read the file directly
+            # First, try to read the audio directly
             try:
-                data, samplerate = sf.read(speaker_wav_path)
+                data, samplerate = sf.read(audio_bytes)
                 logger.info(f"Successfully read speaker file: {len(data)} samples at {samplerate}Hz")
             except Exception as sf_error:
                 logger.warning(f"Soundfile couldn't read the file directly: {sf_error}")
 
-                # If soundfile can't read it, try using pydub to convert it
+                # If soundfile can't read it, try using pydub to decode it
+                if AudioSegment is None:
+                    logger.error("pydub not available for audio conversion")
+                    raise Exception("Audio file format not supported. Please upload a WAV file.")
+
                 try:
-                    from pydub import AudioSegment
-                    from pydub.utils import which
                     logger.info("Attempting to convert audio using pydub...")
 
-                    # Set ffmpeg path explicitly
-                    AudioSegment.converter = "/opt/homebrew/bin/ffmpeg"
-                    AudioSegment.ffmpeg = "/opt/homebrew/bin/ffmpeg"
-                    AudioSegment.ffprobe = "/opt/homebrew/bin/ffprobe"
-
-                    # Load the audio file with pydub (supports many formats)
-                    audio = AudioSegment.from_file(speaker_wav_path)
+                    # Load the audio with pydub (supports many formats)
+                    audio_bytes.seek(0)
+                    audio = AudioSegment.from_file(audio_bytes)
 
-                    # Convert to WAV format with the right settings
+                    # Convert to the right settings and decode to float samples
                     audio = audio.set_frame_rate(22050).set_channels(1)
+                    full_scale = float(1 << (8 * audio.sample_width - 1))
+                    data = np.array(audio.get_array_of_samples(), dtype=np.float32) / full_scale
+                    samplerate = audio.frame_rate
+                    logger.info(f"Successfully converted speaker file: {len(data)} samples at {samplerate}Hz")
 
-                    # Save as proper WAV file
-                    converted_path = speaker_wav_path.replace('.wav', '_converted.wav')
-                    audio.export(converted_path, format="wav")
-
-                    # Replace the original file
-                    os.unlink(speaker_wav_path)
-                    os.rename(converted_path, speaker_wav_path)
-
-                    # Now try to read it again
-                    data, samplerate = sf.read(speaker_wav_path)
-                    logger.info(f"Successfully converted and read speaker file: {len(data)} samples at {samplerate}Hz")
-
-                except ImportError:
-                    logger.error("pydub not available for audio conversion")
-                    raise Exception("Audio file format not supported. Please upload a WAV file.")
                 except Exception as pydub_error:
                     logger.error(f"pydub conversion failed: {pydub_error}")
                     raise Exception(f"Failed to convert audio file: {str(pydub_error)}")
 
-            # Ensure the audio is in the right format for Coqui TTS
-            if samplerate != 22050:
-                logger.info(f"Resampling from {samplerate}Hz to 22050Hz")
-                from scipy import signal
-
-                # Calculate resampling ratio
-                resample_ratio = 22050 / samplerate
-                new_length = int(len(data) * resample_ratio)
-
-                # Resample the audio
-                data = signal.resample(data, new_length)
-
-                # Save the resampled audio
-                sf.write(speaker_wav_path, data, 22050)
-                logger.info("Resampled audio saved")
-
             # Ensure mono audio
             if len(data.shape) > 1:
                 data = np.mean(data, axis=1)
-                sf.write(speaker_wav_path, data, 22050)
                 logger.info("Converted to mono audio")
 
+            # Ensure the audio is in the right format for Coqui TTS
+            if samplerate != 22050:
+                logger.info(f"Resampling from {samplerate}Hz to 22050Hz")
+                if soxr is not None:
+                    data = soxr.resample(data, samplerate, 22050, quality='HQ')
+                else:
+                    data = signal.resample_poly(data, up=22050, down=samplerate)
+
+            # Save the conditioned audio in a single write
+            speaker_wav_path = scratch_path()
+            sf.write(speaker_wav_path, data, 22050, subtype='PCM_16')
+
         except Exception as audio_error:
             logger.error(f"Failed to process speaker audio file: {audio_error}")
-            # Clean up the temporary file
-            if os.path.exists(speaker_wav_path):
-                os.unlink(speaker_wav_path)
             raise Exception(f"Invalid audio file format: {str(audio_error)}")
         
         logger.info(f"Voice cloning with speaker file: {speaker_wav_path}")
         
         # Generate speech with voice cloning
-        wav = tts.tts(text=text, speaker_wav=speaker_wav_path, language=language)
-        
-        # Convert to audio file with proper format
-        audio_buffer = io.BytesIO()
-
-        # Ensure wav is a numpy array and has the right format
-        if isinstance(wav, list):
-            wav = np.array(wav)
-
-        # Normalize audio to prevent clipping
-        if wav.max() > 1.0 or wav.min() < -1.0:
-            wav = wav / np.max(np.abs(wav))
-
-        # Write as WAV with proper sample rate
-        sf.write(audio_buffer, wav, 22050, format='WAV', subtype='PCM_16')
-        audio_buffer.seek(0)
-
-        # Clean up temporary file
-        os.unlink(speaker_wav_path)
-
-        # Return with proper headers to avoid 206 Partial Content
-        return send_file(
-            audio_buffer,
-            mimetype='audio/wav',
-            as_attachment=False,
-            download_name='cloned_speech.wav',
-            conditional=False  # Disable conditional requests that cause 206
-        )
+        future = tts_worker.submit(text, speaker_wav_path, language)
+        try:
+            wav = future.result(timeout=SYNTHESIS_TIMEOUT)
+        except FutureTimeoutError:
+            return synthesis_timeout_response(future)
+
+        # Stream as WAV with proper sample rate
+        return wav_response(wav, 22050, 'cloned_speech.wav')
         
     except Exception as e:
         logger.error(f"Speaker similarity TTS error: {e}")
         return jsonify({"error": str(e)}), 500
+    finally:
+        discard_scratch_file(speaker_wav_path, future)
+
+# Server info never changes at runtime, so serialize it once
+SERVER_INFO_JSON = json.dumps({
+    "models": ["tts_models/multilingual/multi-dataset/xtts_v2"],
+    "languages": ["en", "es", "fr", "de", "it", "pt", "pl", "tr", "ru", "nl", "cs", "ar", "zh-cn", "ja", "hu", "ko"],
+    "speakers": [],
+    "status": "ready"
+}).encode()
+
+# Let probes and load balancers reuse status responses briefly
+STATUS_CACHE_CONTROL = 'max-age=5'
 
 @app.route('/api/tts/info', methods=['GET'])
 def get_server_info():
     """Get server information and available models"""
-    try:
-        return jsonify({
-            "models": ["tts_models/multilingual/multi-dataset/xtts_v2"],
-            "languages": ["en", "es", "fr", "de", "it", "pt", "pl", "tr", "ru", "nl", "cs", "ar", "zh-cn", "ja", "hu", "ko"],
-            "speakers": [],
-            "status": "ready"
-        })
-    except Exception as e:
-        logger.error(f"Server info error: {e}")
-        return jsonify({"error": str(e)}), 500
+    # Read-only: never waits on the synthesis worker or touches the synthesizer
+    return Response(
+        SERVER_INFO_JSON,
+        mimetype='application/json',
+        headers={'Cache-Control': STATUS_CACHE_CONTROL}
+    )
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    # Read-only: only checks the module-level model reference
+    response = jsonify({
         "status": "healthy",
         "model_loaded": tts is not None
     })
+    response.headers['Cache-Control'] = STATUS_CACHE_CONTROL
+    return response
 
 if __name__ == '__main__':
     logger.info("Starting Coqui TTS Server...")
@@ -370,5 +892,5 @@ if __name__ == '__main__':
         logger.error("Failed to initialize TTS model. Exiting.")
         exit(1)
     
-    logger.info("Starting Flask server on port 5002...")
-    app.run(host='0.0.0.0', port=5002, debug=False)
+    logger.info("Starting Flask development server on port 5002 (use gunicorn -c gunicorn.conf.py coqui_server:app in production)...")
+    app.run(host='0.0.0.0', port=5002, debug=False, threaded=True)
@@ -0,0 +1,44 @@
+"""
+Gunicorn configuration for the Coqui TTS server
+Run with: gunicorn -c gunicorn.conf.py coqui_server:app
+"""
+
+import sys
+import threading
+
+from gunicorn.arbiter import Arbiter
+
+bind = "0.0.0.0:5002"
+
+# A single worker keeps one copy of the model on the GPU; threads let uploads,
+# downloads and health checks overlap with synthesis on the TTS worker thread
+worker_class = "gthread"
+workers = 1
+threads = 8
+
+# Seconds without a heartbeat before the arbiter kills the worker. Boot sends
+# heartbeats while the model loads, so this does not need to cover a first-run
+# XTTS download or torch.compile warm-up.
+timeout = 120
+
+
+def post_worker_init(worker):
+    """Load the TTS model inside the worker so CUDA is never initialized before fork"""
+    from coqui_server import initialize_tts
+
+    # The worker only heartbeats from run(), which starts after this hook returns
+    loaded = threading.Event()
+
+    def heartbeat():
+        while not loaded.wait(timeout / 4):
+            worker.notify()
+
+    threading.Thread(target=heartbeat, name="boot-heartbeat", daemon=True).start()
+    try:
+        ok = initialize_tts()
+    finally:
+        loaded.set()
+
+    if not ok:
+        worker.log.error("Failed to initialize TTS model. Exiting.")
+        sys.exit(Arbiter.WORKER_BOOT_ERROR)
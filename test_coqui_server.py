@@ -0,0 +1,282 @@
+"""
+Model-free tests for the Coqui TTS server helpers
+Run with: python -m pytest -q test_coqui_server.py
+"""
+
+import io
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+# The server imports Flask, torch and TTS at module level
+coqui_server = pytest.importorskip("coqui_server")
+np = pytest.importorskip("numpy")
+sf = pytest.importorskip("soundfile")
+
+
+class StubModel:
+    """Stands in for the XTTS model: records latent requests, fails on demand"""
+
+    config = SimpleNamespace(
+        temperature=0.75, length_penalty=1.0, repetition_penalty=10.0, top_k=50, top_p=0.85,
+        gpt_cond_len=12, gpt_cond_chunk_len=4, max_ref_len=10, sound_norm_refs=False,
+    )
+
+    def __init__(self):
+        self.latent_calls = []
+
+    def get_conditioning_latents(self, audio_path, **kwargs):
+        self.latent_calls.append(audio_path)
+        return ("gpt_cond_latent", "speaker_embedding")
+
+    def inference(self, text, language, gpt_cond_latent, speaker_embedding, **kwargs):
+        if text == "boom":
+            raise RuntimeError("synthesis exploded")
+        return {"wav": np.ones(4, dtype=np.float32)}
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    model = StubModel()
+    synthesizer = SimpleNamespace(tts_model=model, split_into_sentences=lambda text: [text])
+    monkeypatch.setattr(coqui_server, "tts", SimpleNamespace(synthesizer=synthesizer))
+    return model
+
+
+def test_wav_header_is_canonical_pcm16():
+    header = coqui_server.build_wav_header(1000, 22050)
+    assert len(header) == 44
+    assert header[:4] == b"RIFF" and header[8:16] == b"WAVEfmt "
+    assert int.from_bytes(header[4:8], "little") == 36 + 1000
+    assert int.from_bytes(header[40:44], "little") == 1000
+
+
+def test_wav_response_round_trips_through_soundfile():
+    t = np.linspace(0, 1, 22050, endpoint=False, dtype=np.float32)
+    wav = 0.5 * np.sin(2 * np.pi * 440 * t)
+
+    response = coqui_server.wav_response(wav, 22050, "speech.wav")
+    body = response.get_data()
+
+    assert response.mimetype == "audio/wav"
+    assert int(response.headers["Content-Length"]) == len(body)
+    data, samplerate = sf.read(io.BytesIO(body), dtype="float32")
+    assert samplerate == 22050
+    assert data.shape == wav.shape
+    np.testing.assert_allclose(data, wav, atol=2 / 32767)
+
+
+def test_wav_response_normalizes_clipping_audio():
+    wav = np.array([0.0, 2.0, -1.0, -2.0], dtype=np.float32)
+
+    data, _ = sf.read(io.BytesIO(coqui_server.wav_response(wav, 22050, "x.wav").get_data()), dtype="float32")
+
+    np.testing.assert_allclose(data, wav / 2.0, atol=2 / 32767)
+
+
+def test_worker_propagates_synthesis_errors_and_keeps_serving(stub_model):
+    worker = coqui_server.TTSWorker()
+
+    with pytest.raises(RuntimeError, match="synthesis exploded"):
+        worker.submit("boom", None, "en").result(timeout=10)
+
+    wav = worker.submit("hello", None, "en").result(timeout=10)
+    assert len(wav) == 4 + coqui_server.SENTENCE_PAUSE_SAMPLES
+    np.testing.assert_array_equal(wav[:4], np.ones(4))
+
+
+def test_worker_propagates_errors_outside_inference(monkeypatch):
+    monkeypatch.setattr(coqui_server, "tts", None)
+    worker = coqui_server.TTSWorker()
+
+    with pytest.raises(AttributeError):
+        worker.submit("hello", None, "en").result(timeout=10)
+
+
+def test_worker_rejects_non_string_inputs():
+    worker = coqui_server.TTSWorker()
+
+    with pytest.raises(ValueError):
+        worker.submit("hello", None, ["en"])
+    with pytest.raises(ValueError):
+        worker.submit("hello", {"path": "x.wav"}, "en")
+
+
+def test_speaker_latent_cache_evicts_least_recently_used(stub_model, tmp_path):
+    paths = {}
+    for name in "abc":
+        paths[name] = str(tmp_path / f"{name}.wav")
+        with open(paths[name], "wb") as f:
+            f.write(name.encode() * 64)
+
+    cache = coqui_server.SpeakerLatentCache(max_size=2)
+    for name in "abacb":
+        cache.get(paths[name])
+
+    # "a" was refreshed before "c" arrived, so "b" was evicted and re-encoded
+    assert stub_model.latent_calls == [paths["a"], paths["b"], paths["c"], paths["b"]]
+    assert len(cache._entries) == 2
+
+
+def test_speaker_latent_cache_keys_on_content_not_path(stub_model, tmp_path):
+    first, second = tmp_path / "first.wav", tmp_path / "second.wav"
+    first.write_bytes(b"same voice")
+    second.write_bytes(b"same voice")
+
+    cache = coqui_server.SpeakerLatentCache()
+    cache.get(str(first))
+    cache.get(str(second))
+
+    assert stub_model.latent_calls == [str(first)]
+
+
+@pytest.mark.parametrize("frames", [200, 256, 300])
+def test_cuda_graph_buckets_trim_to_the_unpadded_decoder_output(frames):
+    torch = pytest.importorskip("torch")
+    from TTS.tts.layers.xtts.hifigan_decoder import HifiDecoder
+
+    torch.manual_seed(0)
+    decoder = HifiDecoder(decoder_input_dim=16, upsample_initial_channel_decoder=32, d_vector_dim=8).eval()
+    graphed = coqui_server.CudaGraphedModule(decoder)
+    latents, g = torch.randn(1, frames, 16), torch.randn(1, 8, 1)
+
+    # Run the pad/trim path the CUDA graphs replay, eagerly on CPU
+    padded = latents.new_empty(graphed._padded_shape(latents))
+    graphed._pad_into(padded, latents)
+    with torch.inference_mode():
+        expected = decoder(latents, g=g)
+        trimmed = graphed._trim(decoder(padded, g=g), padded.shape[1], frames)
+
+    assert padded.shape[1] % graphed.bucket_frames == 0
+    assert trimmed.shape == expected.shape
+    # Padding only changes the tail within the generator's receptive field
+    head = expected.shape[-1] - 4096
+    torch.testing.assert_close(trimmed[..., :head], expected[..., :head])
+
+
+@pytest.mark.parametrize("size", [1024, 3 << 20])
+def test_save_upload_copies_in_memory_and_rolled_over_spools(tmp_path, size):
+    payload = bytes(range(256)) * (size // 256)
+    spool = coqui_server.tempfile.SpooledTemporaryFile(max_size=1 << 20)
+    spool.write(payload)
+    spool.seek(0)
+
+    dst_path = tmp_path / "upload.wav"
+    with open(dst_path, "wb") as dst:
+        coqui_server.save_upload(SimpleNamespace(stream=spool), dst)
+
+    assert spool._rolled == (size > 1 << 20)
+    assert dst_path.read_bytes() == payload
+
+
+def test_save_upload_finishes_the_copy_when_sendfile_stops_early(tmp_path, monkeypatch):
+    payload = bytes(range(256)) * (3 << 12)
+    spool = coqui_server.tempfile.SpooledTemporaryFile(max_size=1 << 10)
+    spool.write(payload)
+    spool.seek(0)
+
+    # Let the kernel copy half of the file, then report end of file
+    half = len(payload) // 2
+    real_sendfile = coqui_server.os.sendfile
+
+    def short_sendfile(out_fd, in_fd, offset, count):
+        return real_sendfile(out_fd, in_fd, offset, half - offset) if offset < half else 0
+
+    monkeypatch.setattr(coqui_server.os, "sendfile", short_sendfile)
+
+    dst_path = tmp_path / "upload.wav"
+    with open(dst_path, "wb") as dst:
+        coqui_server.save_upload(SimpleNamespace(stream=spool), dst)
+
+    assert dst_path.read_bytes() == payload
+
+
+def test_tts_cancels_requests_that_time_out_in_the_queue(stub_model, tmp_path, monkeypatch):
+    release = threading.Event()
+    texts = []
+
+    def inference(text, *args, **kwargs):
+        texts.append(text)
+        release.wait(10)
+        return {"wav": np.ones(4, dtype=np.float32)}
+
+    monkeypatch.setattr(stub_model, "inference", inference)
+    monkeypatch.setattr(coqui_server, "tts_worker", coqui_server.TTSWorker())
+    monkeypatch.setattr(coqui_server, "SCRATCH_DIR", str(tmp_path))
+    monkeypatch.setattr(coqui_server, "SYNTHESIS_TIMEOUT", 0.2)
+
+    # Keep the worker busy so the request below times out while still queued
+    busy = coqui_server.tts_worker.submit("busy", None, "en")
+    response = coqui_server.app.test_client().post(
+        "/api/tts", data={"text": "hello", "speaker_wav": (io.BytesIO(b"RIFF"), "voice.wav")}
+    )
+    release.set()
+    busy.result(timeout=10)
+
+    assert response.status_code == 503
+    assert "timed out" in response.get_json()["error"]
+    assert texts == ["busy"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_tts_removes_the_upload_when_synthesis_fails(stub_model, tmp_path, monkeypatch):
+    monkeypatch.setattr(coqui_server, "tts_worker", coqui_server.TTSWorker())
+    monkeypatch.setattr(coqui_server, "SCRATCH_DIR", str(tmp_path))
+
+    response = coqui_server.app.test_client().post(
+        "/api/tts", data={"text": "boom", "speaker_wav": (io.BytesIO(b"RIFF"), "voice.wav")}
+    )
+
+    assert response.status_code == 500
+    assert "synthesis exploded" in response.get_json()["error"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_tts_removes_the_upload_of_a_timed_out_job_once_it_finishes(stub_model, tmp_path, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def inference(text, *args, **kwargs):
+        started.set()
+        release.wait(10)
+        return {"wav": np.ones(4, dtype=np.float32)}
+
+    monkeypatch.setattr(stub_model, "inference", inference)
+    monkeypatch.setattr(coqui_server, "tts_worker", coqui_server.TTSWorker())
+    monkeypatch.setattr(coqui_server, "SCRATCH_DIR", str(tmp_path))
+    monkeypatch.setattr(coqui_server, "SYNTHESIS_TIMEOUT", 0.5)
+
+    response = coqui_server.app.test_client().post(
+        "/api/tts", data={"text": "hello", "speaker_wav": (io.BytesIO(b"RIFF"), "voice.wav")}
+    )
+
+    # The worker was already synthesizing, so the file must outlive the handler
+    assert response.status_code == 503 and started.is_set()
+    assert len(list(tmp_path.iterdir())) == 1
+
+    release.set()
+    coqui_server.tts_worker.submit("after", None, "en").result(timeout=10)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_tts_rejects_non_string_json_fields():
+    client = coqui_server.app.test_client()
+
+    response = client.post("/api/tts", json={"text": "hi", "language": ["en"]})
+
+    assert response.status_code == 400
+
+
+def test_default_speaker_prefers_uploaded_voices(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(coqui_server, "_DEFAULT_SPEAKER_PATH", None)
+
+    # With nothing uploaded yet, the synthetic voice is created and used
+    synthetic = coqui_server._resolve_default_speaker()
+    assert synthetic == os.path.join("temp_voices", coqui_server.DEFAULT_SPEAKER_FILENAME)
+    assert (tmp_path / synthetic).is_file()
+
+    # A real voice added later wins over the synthetic one
+    (tmp_path / "temp_voices" / "user_voice.wav").write_bytes(b"RIFF")
+    assert coqui_server._resolve_default_speaker() == os.path.join("temp_voices", "user_voice.wav")